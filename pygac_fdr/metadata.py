@@ -19,16 +19,30 @@
 """Collect and complement L1C metadata."""
 
 import logging
+import os
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
 from datetime import datetime
 from enum import IntEnum
+from functools import partial
 
 import netCDF4
 import numpy as np
 import pandas as pd
 import xarray as xr
+from numpy.lib.stride_tricks import sliding_window_view
 from xarray.coding.times import encode_cf_datetime
 
+try:
+    from numba import njit
+except ImportError:
+
+    def njit(*args, **kwargs):
+        """Fallback if numba is not available: Don't compile."""
+        return lambda func: func
+
+
 LOG = logging.getLogger(__package__)
 
 
@@ -52,6 +66,15 @@ TIME_COVERAGE = {
     "TIROS-N": (datetime(1978, 11, 5, 9, 8), datetime(1980, 1, 30, 17, 3)),
 }  # Estimated based on NOAA L1B archive
 
+# Time coverage as integer nanoseconds (open end replaced by a date in the far future)
+_TIME_COVERAGE_NS = {
+    platform: (
+        np.datetime64(valid_min, "ns").astype(np.int64),
+        np.datetime64(valid_max or datetime(2030, 1, 1), "ns").astype(np.int64),
+    )
+    for platform, (valid_min, valid_max) in TIME_COVERAGE.items()
+}
+
 
 class QualityFlags(IntEnum):
     OK = 0
@@ -119,6 +142,39 @@ ADDITIONAL_METADATA = [
     },
 ]
 
+# Name, dtype, fill value and netCDF attributes of each additional metadata variable
+_ADDITIONAL_METADATA_COMPILED = [
+    (
+        add_mda["name"],
+        add_mda["dtype"],
+        add_mda["fill_value"],
+        {
+            key: val
+            for key, val in add_mda.items()
+            if key not in ("name", "dtype", "fill_value")
+        },
+    )
+    for add_mda in ADDITIONAL_METADATA
+]
+
+# Column types of the collected metadata. Scanline numbers are nullable, because a file might
+# have no midnight line or no overlap information.
+METADATA_DTYPES = {
+    "platform": "category",
+    "start_time": "datetime64[ns]",
+    "end_time": "datetime64[ns]",
+    "along_track": np.int32,
+    "filename": "string",
+    "equator_crossing_longitude_1": np.float64,
+    "equator_crossing_time_1": "datetime64[ns]",
+    "equator_crossing_longitude_2": np.float64,
+    "equator_crossing_time_2": "datetime64[ns]",
+    "midnight_line": "Int16",
+    "overlap_free_start": "Int16",
+    "overlap_free_end": "Int16",
+    "global_quality_flag": np.uint8,
+}
+
 
 class MetadataCollector:
     """Collect and complement metadata from level 1c files.
@@ -127,92 +183,186 @@ class MetadataCollector:
     overlap information.
     """
 
-    def __init__(self, min_num_lines=50, min_duration=5):
+    def_engine = "netcdf4"
+
+    def __init__(self, min_num_lines=50, min_duration=5, engine=None):
         """
         Args:
             min_num_lines: Minimum number of scanlines for a file to be considered ok. Otherwise
                            it will flagged as too short.
             min_duration: Minimum duration (in minutes) for a file to be considered ok. Otherwise
                           it will flagged as too short.
+            engine: xarray backend used to read level 1c files. Defaults to netcdf4.
         """
         self.min_num_lines = min_num_lines
         self.min_duration = np.timedelta64(min_duration, "m")
+        self.engine = engine or self.def_engine
+
+    def get_metadata(self, filenames, cache_file=None):
+        """Collect and complement metadata from the given level 1c files.
 
-    def get_metadata(self, filenames):
-        """Collect and complement metadata from the given level 1c files."""
+        Args:
+            filenames: Level 1c files to be analyzed.
+            cache_file: Parquet file for caching metadata collected from level 1c files across
+                        runs. Only files that are new or have been modified since the last run
+                        are read. Requires pyarrow or fastparquet.
+        """
         LOG.info("Collecting metadata")
-        df = pd.DataFrame(self._collect_metadata(filenames))
+        df = self._collect_metadata(filenames, cache_file=cache_file)
+        if df.empty:
+            LOG.warning("No files to be analyzed")
+            return df
         df.sort_values(by=["start_time", "end_time"], inplace=True)
 
-        # Set quality flags
-        LOG.info("Computing quality flags")
-        df = df.groupby("platform").apply(
-            lambda x: self._set_global_qual_flags(x, x.name)
-        )
-        df = df.drop(["platform"], axis=1)
+        # Set quality flags and calculate overlap. Platforms are independent of each other, so
+        # process them one by one and concatenate the results.
+        LOG.info("Computing quality flags and overlap")
+        platforms = []
+        for platform, df_platform in df.groupby("platform", sort=False, observed=True):
+            df_platform = self._set_global_qual_flags(df_platform, platform)
+            df_platform = self._calc_overlap(df_platform)
+            platforms.append(df_platform)
+        df = pd.concat(platforms, ignore_index=True)
 
-        # Calculate overlap
-        LOG.info("Computing overlap")
-        df = df.groupby("platform").apply(lambda x: self._calc_overlap(x))
+        # Timestamps have only been kept for the overlap computation
+        df = df.drop(["acq_time"], axis=1)
 
         return df
 
     def save_sql(self, mda, dbfile, if_exists):
-        """Save metadata to sqlite database."""
-        con = sqlite3.connect(dbfile)
-        mda.to_sql(name="metadata", con=con, if_exists=if_exists)
-        con.commit()
-        con.close()
+        """Save metadata to sqlite database.
+
+        Pandas inserts all rows with a single executemany() call. Make sure that this happens
+        in a single transaction and skip intermediate disk syncs.
+        """
+        with closing(sqlite3.connect(dbfile)) as con:
+            con.execute("PRAGMA synchronous = NORMAL")
+            with con:
+                mda.to_sql(name="metadata", con=con, if_exists=if_exists, index=False)
 
     def read_sql(self, dbfile):
         """Read metadata from sqlite database."""
         with sqlite3.connect(dbfile) as con:
             mda = pd.read_sql("select * from metadata", con)
-        mda = mda.set_index(["platform", "level_1"])
         mda.fillna(value=np.nan, inplace=True)
-        for col in mda.columns:
-            if "time" in col:
-                mda[col] = mda[col].astype("datetime64[ns]")
+        mda = mda.astype(METADATA_DTYPES)
         return mda
 
-    def _collect_metadata(self, filenames):
-        """Collect metadata from the given level 1c files."""
-        records = []
-        for filename in filenames:
-            LOG.debug("Collecting metadata from {}".format(filename))
-            with xr.open_dataset(filename) as ds:
-                midnight_line = np.float64(self._get_midnight_line(ds["acq_time"]))
-                eq_cross_lons, eq_cross_times = self._get_equator_crossings(ds)
-                rec = {
-                    "platform": ds.attrs["platform"].split(">")[-1].strip(),
-                    "start_time": ds["acq_time"].values[0],
-                    "end_time": ds["acq_time"].values[-1],
-                    "along_track": ds.dims["y"],
-                    "filename": filename,
-                    "orbit_number_start": ds.attrs["orbit_number_start"],
-                    "orbit_number_end": ds.attrs["orbit_number_end"],
-                    "equator_crossing_longitude_1": eq_cross_lons[0],
-                    "equator_crossing_time_1": eq_cross_times[0],
-                    "equator_crossing_longitude_2": eq_cross_lons[1],
-                    "equator_crossing_time_2": eq_cross_times[1],
-                    "midnight_line": midnight_line,
-                    "overlap_free_start": np.nan,
-                    "overlap_free_end": np.nan,
-                    "global_quality_flag": QualityFlags.OK,
-                }
-                records.append(rec)
-        return records
+    def _collect_metadata(self, filenames, cache_file=None):
+        """Collect metadata from the given level 1c files, using the cache if given."""
+        if len(filenames) == 0:
+            return pd.DataFrame(columns=list(METADATA_DTYPES)).astype(METADATA_DTYPES)
+        if cache_file:
+            df = self._collect_metadata_cached(filenames, cache_file)
+        else:
+            df = self._read_metadata(filenames)
+        return df.astype(METADATA_DTYPES)
+
+    def _collect_metadata_cached(self, filenames, cache_file):
+        """Collect metadata from the given level 1c files using a cache file.
+
+        Cache entries are identified by filename, modification time and size of the level 1c
+        file. Files without a valid cache entry are read and the cache file is updated. Entries
+        of files which have not been requested are kept.
+        """
+        file_keys = ["filename", "file_mtime", "file_size"]
+        stats = [os.stat(filename) for filename in filenames]
+        stats = pd.DataFrame(
+            {
+                "filename": filenames,
+                "file_mtime": [stat.st_mtime_ns for stat in stats],
+                "file_size": [stat.st_size for stat in stats],
+            }
+        )
+
+        # The same file might be requested more than once. Look up and store each file only
+        # once, otherwise cache entries would multiply with every run.
+        unique_stats = stats.drop_duplicates(file_keys)
+        if os.path.isfile(cache_file):
+            cache = pd.read_parquet(cache_file).drop_duplicates(file_keys)
+            cached = cache.merge(unique_stats, on=file_keys, how="inner")
+            outdated = unique_stats[~unique_stats["filename"].isin(cached["filename"])]
+        else:
+            cache = cached = None
+            outdated = unique_stats
+        LOG.info(
+            "Found {} files in cache, reading {} files".format(
+                len(unique_stats) - len(outdated), len(outdated)
+            )
+        )
+        df = cached
+        if not outdated.empty:
+            new = self._read_metadata(outdated["filename"])
+            new = new.assign(
+                file_mtime=outdated["file_mtime"].values,
+                file_size=outdated["file_size"].values,
+            )
+            df = pd.concat([cached, new], ignore_index=True)
+
+        # Update cache
+        if cache is not None:
+            df_cache = pd.concat(
+                [df, cache[~cache["filename"].isin(df["filename"])]], ignore_index=True
+            )
+        else:
+            df_cache = df
+        df_cache.drop_duplicates(file_keys).to_parquet(cache_file, index=False)
+
+        # Expand to the requested files (in the requested order)
+        df = df.drop(file_keys[1:], axis=1)
+        return stats[["filename"]].merge(df, on="filename", how="left")[df.columns]
+
+    def _read_metadata(self, filenames):
+        """Read metadata from the given level 1c files.
+
+        Files are read one after another. Reading them in threads doesn't help, because
+        xarray serializes all HDF5 access with a global lock.
+        """
+        records = [self._collect_file_metadata(filename) for filename in filenames]
+        return pd.DataFrame(records)
+
+    def _collect_file_metadata(self, filename):
+        """Collect metadata from a single level 1c file."""
+        LOG.debug("Collecting metadata from {}".format(filename))
+        with xr.open_dataset(filename, engine=self.engine) as ds:
+            acq_time = ds["acq_time"].values
+            midnight_line = self._get_midnight_line(acq_time)
+            eq_cross_lons, eq_cross_times = self._get_equator_crossings(ds, acq_time)
+            rec = {
+                "platform": ds.attrs["platform"].split(">")[-1].strip(),
+                "start_time": acq_time[0],
+                "end_time": acq_time[-1],
+                "along_track": ds.dims["y"],
+                "filename": filename,
+                "acq_time": acq_time,
+                "orbit_number_start": ds.attrs["orbit_number_start"],
+                "orbit_number_end": ds.attrs["orbit_number_end"],
+                "equator_crossing_longitude_1": eq_cross_lons[0],
+                "equator_crossing_time_1": eq_cross_times[0],
+                "equator_crossing_longitude_2": eq_cross_lons[1],
+                "equator_crossing_time_2": eq_cross_times[1],
+                "midnight_line": midnight_line,
+                "overlap_free_start": pd.NA,
+                "overlap_free_end": pd.NA,
+                "global_quality_flag": QualityFlags.OK,
+            }
+        return rec
 
     def _get_midnight_line(self, acq_time):
         """Find scanline where the UTC date increases by one day.
 
+        Args:
+            acq_time (np.ndarray): Scanline acquisition times
+
         Returns:
             int: The midnight scanline if it exists.
-                 None, else.
+                 pd.NA, else.
         """
-        d0 = np.datetime64("1970-01-01", "D")
-        days = (acq_time.astype("datetime64[D]") - d0) / np.timedelta64(1, "D")
-        incr = np.where(np.diff(days) == 1)[0]
+        # Compute day numbers directly from the underlying integers
+        unit, count = np.datetime_data(acq_time.dtype)
+        ticks_per_day = np.timedelta64(1, "D") // np.timedelta64(count, unit)
+        days = acq_time.view(np.int64) // ticks_per_day
+        incr = np.flatnonzero(np.diff(days) == 1)
         if len(incr) >= 1:
             if len(incr) > 1:
                 LOG.warning(
@@ -220,41 +370,45 @@ class MetadataCollector:
                     "occurence as midnight scanline."
                 )
             return incr[0]
-        return np.nan
+        return pd.NA
 
-    def _get_equator_crossings(self, ds):
+    def _get_equator_crossings(self, ds, acq_time):
         """Determine where the ascending node(s) cross the equator.
 
+        Args:
+            ds (xr.Dataset): Level 1c dataset
+            acq_time (np.ndarray): Scanline acquisition times
+
         Returns:
             Longitudes and UTC times of first and second equator crossing, if any, NaN else.
         """
-        lat = ds["latitude"].load()  # load dataset to prevent netCDF4 indexing error
-
         # Use coordinates in the middle of the swath
-        mid_swath = lat.shape[1] // 2
-        lat = lat.isel(x=mid_swath)
-        lat_shift = lat.shift(y=-1, fill_value=lat.isel(y=-1))
-        sign_change = np.sign(lat_shift) != np.sign(lat)
-        ascending = lat_shift > lat
-        lat_eq = lat.where(sign_change & ascending, drop=True)
-
-        num_cross = min(2, len(lat_eq))  # Two crossings max
+        mid_swath = ds["latitude"].shape[1] // 2
+        lat = ds["latitude"].isel(x=mid_swath).values
+
+        # Ascending node crosses the equator between scanlines i and i+1
+        ascending = (lat[:-1] < 0) & (lat[1:] >= 0)
+        idx = np.flatnonzero(ascending)[0:2]  # Two crossings max
+
+        num_cross = len(idx)
         eq_cross_lons = np.full(2, np.nan)
-        eq_cross_times = np.full(
-            2, np.datetime64("NaT"), dtype=lat_eq["acq_time"].dtype
-        )
-        eq_cross_lons[0:num_cross] = lat_eq["longitude"].values[0:num_cross]
-        eq_cross_times[0:num_cross] = lat_eq["acq_time"].values[0:num_cross]
+        eq_cross_times = np.full(2, np.datetime64("NaT"), dtype=acq_time.dtype)
+        eq_cross_lons[0:num_cross] = ds["longitude"].isel(x=mid_swath).values[idx]
+        eq_cross_times[0:num_cross] = acq_time[idx]
         return eq_cross_lons, eq_cross_times
 
-    def _set_redundant_flag(self, df, window=20):
-        """Flag redundant files in the given data frame.
+    def _is_redundant(self, start_times, end_times, ok, window=20):
+        """Identify redundant files.
 
         An file is called redundant if it is entirely overlapped by one of its predecessors
         (in time).
 
         Args:
-            window (int): Number of preceding files to be taken into account
+            start_times (np.ndarray): Start times (integer nanoseconds)
+            end_times (np.ndarray): End times (integer nanoseconds)
+            ok (np.ndarray): Files that passed the QC check so far
+            window (int): Number of files to be taken into account, i.e. the current file and
+                          its (window - 1) predecessors
 
         TODO: Identify the following case as redundant, as it causes overlap_free_start to be
         greater than overlap_free_end:
@@ -263,89 +417,81 @@ class MetadataCollector:
             |--------|  current file
               |---------|  subsequent file
         """
-
-        def is_redundant(end_times):
-            start_times = end_times.index.get_level_values("start_time").to_numpy()
-            end_times = end_times.to_numpy()
-            this_start_time = start_times[-1]
-            this_end_time = end_times[-1]
-            redundant = (this_start_time >= start_times[:-1]) & (
-                this_end_time <= end_times[:-1]
-            )
-            return redundant.any()
-
         # Only take into account files that passed the QC check so far (e.g. we don't want
         # files flagged as TOO_LONG to overlap many subsequent files)
-        df_ok = df[df["global_quality_flag"] == QualityFlags.OK].copy()
+        redundant = np.zeros(len(start_times), dtype=bool)
+        positions = np.flatnonzero(ok)
+        num_prev = window - 1
+        if len(positions) == 0 or num_prev < 1:
+            return redundant
 
         # Sort by ascending start time and descending end time. This is required to catch
         # redundant files with identical start times but different end times.
-        df_ok = df_ok.sort_values(
-            by=["start_time", "end_time"], ascending=[True, False]
+        order = np.lexsort((-end_times[positions], start_times[positions]))
+        positions = positions[order]
+        end_times = end_times[positions]
+
+        # Since all predecessors start earlier (or at the same time), a file is redundant if
+        # any of its predecessors ends later (or at the same time). Compare end times as
+        # integers to avoid the precision loss of floating point rolling windows.
+        padded = np.concatenate(
+            [np.full(num_prev, np.iinfo(np.int64).min), end_times[:-1]]
         )
+        prev_max_end_times = sliding_window_view(padded, num_prev).max(axis=1)
+        redundant[positions] = prev_max_end_times >= end_times
+        return redundant
 
-        # DataFrame.rolling is an elegant solution, but it has two drawbacks:
-        # a) It only supports numerical data types. Workaround: Convert timestamps to integer.
-        df_ok["start_time"] = df_ok["start_time"].astype(np.int64)
-        df_ok["end_time"] = df_ok["end_time"].astype(np.int64)
-
-        # b) DataFrame.rolling().apply() only has access to one column at a time. Workaround: Move
-        #    start_time to the index and pass the end_time series - including the index - to our
-        #    function. This can be achieved by calling apply(..., raw=False).
-        df_ok = df_ok.set_index("start_time", append=True)
-        rolling = df_ok["end_time"].rolling(window, min_periods=2)
-        redundant = rolling.apply(is_redundant, raw=False).fillna(0).astype(np.bool)
-        redundant = redundant.reset_index("start_time", drop=True)
-
-        # So far we have operated on the qc-passed rows only. Update quality flags of rows in the
-        # original (full) data frame.
-        redundant = redundant[redundant.astype(np.bool)]
-        df.loc[redundant.index, "global_quality_flag"] = QualityFlags.REDUNDANT
-
-    def _set_duplicate_flag(self, df):
-        """Flag duplicate files in the given data frame.
+    def _is_duplicate(self, df, start_times, end_times):
+        """Identify duplicate files in the given data frame.
 
         Two files are considered equal if platform, start- and end-time are identical. This happens
-        if the same measurement has been transferred to two different ground stations.
+        if the same measurement has been transferred to two different ground stations. The first
+        occurrence is not considered a duplicate.
         """
-        gs_dupl = df.duplicated(
-            subset=["platform", "start_time", "end_time"], keep="first"
+        # Sort by platform, start- and end-time (stable, so that the first occurrence stays
+        # first). Duplicates are then adjacent to each other.
+        keys = np.stack(
+            [
+                pd.factorize(df["platform"])[0].astype(np.int64),
+                start_times,
+                end_times,
+            ]
         )
-        df.loc[gs_dupl, "global_quality_flag"] = QualityFlags.DUPLICATE
+        order = np.lexsort(keys[::-1])
+        sorted_keys = keys[:, order]
+        duplicate = np.zeros(len(df), dtype=bool)
+        duplicate[order[1:]] = np.all(sorted_keys[:, 1:] == sorted_keys[:, :-1], axis=0)
+        return duplicate
 
-    def _set_invalid_timestamp_flag(self, df, platform):
-        """Flag files with invalid timestamps.
+    def _is_invalid_timestamp(self, start_times, end_times, platform):
+        """Identify files with invalid timestamps.
 
         Timestamps are considered invalid if they are outside the temporal coverage of the platform
         or if end_time < start_time.
         """
-        valid_min, valid_max = TIME_COVERAGE[platform]
-        if not valid_max:
-            valid_max = np.datetime64("2030-01-01 00:00")
-        valid_min = np.datetime64(valid_min)
-        valid_max = np.datetime64(valid_max)
-        out_of_range = (
-            (df["start_time"] < valid_min)
-            | (df["start_time"] > valid_max)
-            | (df["end_time"] < valid_min)
-            | (df["end_time"] > valid_max)
+        valid_min, valid_max = _TIME_COVERAGE_NS[platform]
+        return (
+            (start_times < valid_min)
+            | (start_times > valid_max)
+            | (end_times < valid_min)
+            | (end_times > valid_max)
+            | (end_times < start_times)
         )
-        neg_dur = df["end_time"] < df["start_time"]
-        invalid = neg_dur | out_of_range
-        df.loc[invalid, "global_quality_flag"] = QualityFlags.INVALID_TIMESTAMP
 
-    def _set_too_short_flag(self, df):
-        """Flag files considered too short.
+    def _is_too_short(self, start_times, end_times, along_track, missing):
+        """Identify files considered too short.
 
         That means either not enough scanlines or duration is too short.
         """
-        too_short = (df["along_track"] < self.min_num_lines) | (
-            abs(df["end_time"] - df["start_time"]) < self.min_duration
-        )
-        df.loc[too_short, "global_quality_flag"] = QualityFlags.TOO_SHORT
+        min_duration = self.min_duration.astype("timedelta64[ns]").astype(np.int64)
+
+        # NaT is stored as the smallest int64, so the difference would overflow
+        too_short = ~missing & (np.abs(end_times - start_times) < min_duration)
+        np.logical_or(too_short, along_track < self.min_num_lines, out=too_short)
+        return too_short
 
-    def _set_too_long_flag(self, df, max_length=120):
-        """Flag files where (end_time - start_time) is unrealistically large.
+    def _is_too_long(self, start_times, end_times, missing, max_length=120):
+        """Identify files where (end_time - start_time) is unrealistically large.
 
         This happens if the timestamps of the first or last scanline are corrupted. Flag these
         cases to prevent that subsequent files are erroneously flagged as redundant.
@@ -354,18 +500,51 @@ class MetadataCollector:
             max_length: Maximum length (minutes) for a file to be considered ok. Otherwise it
                         will be flagged as too long.
         """
-        max_length = np.timedelta64(max_length, "m")
-        too_long = (df["end_time"] - df["start_time"]) > max_length
-        df.loc[too_long, "global_quality_flag"] = QualityFlags.TOO_LONG
+        max_length = np.timedelta64(max_length, "m").astype("timedelta64[ns]")
+
+        # NaT is stored as the smallest int64, so the difference would overflow
+        return ~missing & ((end_times - start_times) > max_length.astype(np.int64))
 
     def _set_global_qual_flags(self, df, platform):
-        """Set global quality flags."""
+        """Set global quality flags.
+
+        If multiple checks fail, the first matching flag in the following order is assigned:
+        missing timestamp (flagged as invalid timestamp), duplicate, too long, too short,
+        invalid timestamp. Redundancy is only checked among files that passed all other checks.
+        """
         df = df.reset_index(drop=True)
-        self._set_invalid_timestamp_flag(df, platform)
-        self._set_too_short_flag(df)
-        self._set_too_long_flag(df)
-        self._set_duplicate_flag(df)
-        self._set_redundant_flag(df)
+
+        # Extract timestamps once and pass them to all checks as integers
+        start_times = df["start_time"].to_numpy("datetime64[ns]")
+        end_times = df["end_time"].to_numpy("datetime64[ns]")
+        missing = np.isnat(start_times) | np.isnat(end_times)
+        start_times = start_times.view(np.int64)
+        end_times = end_times.view(np.int64)
+
+        flags = np.select(
+            [
+                missing,
+                self._is_duplicate(df, start_times, end_times),
+                self._is_too_long(start_times, end_times, missing),
+                self._is_too_short(
+                    start_times, end_times, df["along_track"].to_numpy(), missing
+                ),
+                self._is_invalid_timestamp(start_times, end_times, platform),
+            ],
+            [
+                QualityFlags.INVALID_TIMESTAMP,
+                QualityFlags.DUPLICATE,
+                QualityFlags.TOO_LONG,
+                QualityFlags.TOO_SHORT,
+                QualityFlags.INVALID_TIMESTAMP,
+            ],
+            default=QualityFlags.OK,
+        )
+        redundant = self._is_redundant(
+            start_times, end_times, ok=flags == QualityFlags.OK
+        )
+        flags[redundant] = QualityFlags.REDUNDANT
+        df.loc[:, "global_quality_flag"] = flags  # keep dtype
         return df
 
     def _calc_overlap(self, df, open_end=False):
@@ -376,62 +555,137 @@ class MetadataCollector:
         overlap_free_start/end attributes.
         """
         df_ok = df[df["global_quality_flag"] == QualityFlags.OK]
+        if df_ok.empty:
+            return df
+
+        # Pass timestamps as integers and concatenate the acquisition times of all files, so
+        # that the kernel can be compiled.
+        acq_times = [
+            acq_time.astype("datetime64[ns]").view(np.int64)
+            for acq_time in df_ok["acq_time"]
+        ]
+        offsets = np.cumsum([0] + [len(acq_time) for acq_time in acq_times])
+        overlap_free_start, overlap_free_end = _calc_overlap_free_lines(
+            start_times=df_ok["start_time"].to_numpy("datetime64[ns]").view(np.int64),
+            end_times=df_ok["end_time"].to_numpy("datetime64[ns]").view(np.int64),
+            along_track=df_ok["along_track"].to_numpy(np.int64),
+            acq_times=np.concatenate(acq_times),
+            offsets=offsets,
+        )
+        overlap_free_start = pd.array(overlap_free_start, dtype="Int16")
+        overlap_free_end = pd.array(overlap_free_end, dtype="Int16")
+        if open_end:
+            overlap_free_end[-1] = pd.NA
 
-        for i in range(len(df_ok)):
-            this_row = df_ok.iloc[i]
-            prev_row = df_ok.iloc[i - 1] if i > 0 else None
-            next_row = df_ok.iloc[i + 1] if i < len(df_ok) - 1 else None
-            LOG.debug("Computing overlap for {}".format(this_row["filename"]))
-            this_time = xr.open_dataset(this_row["filename"])["acq_time"]
-
-            # Compute overlap with preceding file
-            if prev_row is not None:
-                if prev_row["end_time"] >= this_row["start_time"]:
-                    prev_end_time = prev_row["end_time"].to_datetime64()
-                    overlap_free_start = (this_time > prev_end_time).argmax().values
-                else:
-                    overlap_free_start = 0
-                df.loc[df_ok.index[i], "overlap_free_start"] = overlap_free_start
-            else:
-                # First file
-                df.loc[df_ok.index[i], "overlap_free_start"] = 0
-
-            # Compute overlap with subsequent file
-            if next_row is not None:
-                if this_row["end_time"] >= next_row["start_time"]:
-                    next_start_time = next_row["start_time"].to_datetime64()
-                    overlap_free_end = (
-                        this_time >= next_start_time
-                    ).argmax().values - 1
-                else:
-                    overlap_free_end = this_row["along_track"] - 1
-                df.loc[df_ok.index[i], "overlap_free_end"] = overlap_free_end
-            elif not open_end:
-                # Last file
-                df.loc[df_ok.index[i], "overlap_free_end"] = this_row["along_track"] - 1
-
+        df.loc[df_ok.index, "overlap_free_start"] = overlap_free_start
+        df.loc[df_ok.index, "overlap_free_end"] = overlap_free_end
         return df
 
 
+@njit(cache=True)
+def _calc_overlap_free_lines(start_times, end_times, along_track, acq_times, offsets):
+    """Determine overlap-free part of consecutive files.
+
+    Args:
+        start_times: Start times (integer nanoseconds) of all files.
+        end_times: End times (integer nanoseconds) of all files.
+        along_track: Number of scanlines of all files.
+        acq_times: Acquisition times (integer nanoseconds) of all files, concatenated.
+        offsets: Index of the first scanline of each file in acq_times, with a final entry
+                 pointing behind the last scanline.
+
+    Returns:
+        First and last overlap-free scanline (0-based) of each file.
+    """
+    num_files = len(start_times)
+    overlap_free_start = np.zeros(num_files, dtype=np.int64)
+    overlap_free_end = along_track - 1
+    for i in range(num_files):
+        this_time = acq_times[offsets[i] : offsets[i + 1]]
+
+        # Compute overlap with preceding file. Timestamps are monotonic, so use binary search.
+        if i > 0 and end_times[i - 1] >= start_times[i]:
+            overlap_free_start[i] = np.searchsorted(
+                this_time, end_times[i - 1], side="right"
+            )
+
+        # Compute overlap with subsequent file
+        if i < num_files - 1 and end_times[i] >= start_times[i + 1]:
+            overlap_free_end[i] = (
+                np.searchsorted(this_time, start_times[i + 1], side="left") - 1
+            )
+    return overlap_free_start, overlap_free_end
+
+
 class MetadataUpdater:
+    def __init__(self, num_workers=None):
+        """
+        Args:
+            num_workers: Number of processes used to update level 1c files. Defaults to the
+                         number of processors.
+        """
+        self.num_workers = num_workers
+
     def update(self, mda):
         """Add additional metadata to level 1c files.
 
         Since xarray cannot modify files in-place, use netCDF4 directly. See
         https://github.com/pydata/xarray/issues/2029.
+
+        Files are independent of each other, so update them concurrently. Use processes
+        instead of threads, because the underlying HDF5 library is not thread-safe.
         """
         mda = self._to_xarray(mda)
         mda = self._stack(mda)
-        for irow in range(mda.dims["row"]):
-            row = mda.isel(row=irow)
-            LOG.debug("Updating metadata in {}".format(row["filename"].item()))
-            with netCDF4.Dataset(filename=row["filename"].item(), mode="r+") as nc:
-                self._update_file(nc=nc, row=row)
+        mda = self._encode_times(mda)
+        mda = self._fill_missing(mda)
+
+        # Iterate over plain tuples of numpy values instead of selecting rows from the dataset
+        names = ["filename"] + [add_mda["name"] for add_mda in ADDITIONAL_METADATA]
+        dims = {name: mda[name].dims[1:] for name in names}
+        rows = zip(*[mda[name].values for name in names])
+        update_row = partial(self._update_row, names=names, dims=dims)
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(update_row, row) for row in rows]
+
+            # Log in the main process, worker processes might not inherit the logging setup
+            for filename, future in zip(mda["filename"].values, futures):
+                try:
+                    future.result()
+                except Exception:
+                    LOG.error("Failed to update metadata in {}".format(filename))
+                    raise
+                LOG.debug("Updated metadata in {}".format(filename))
+
+    def _update_row(self, row, names, dims):
+        """Update metadata in the file corresponding to the given row.
+
+        Args:
+            row (tuple): Filename and additional metadata
+            names (list): Names of the tuple elements
+            dims (dict): Dimensions of each element (excluding the row dimension)
+        """
+        row = dict(zip(names, row))
+        with netCDF4.Dataset(filename=row["filename"], mode="r+") as nc:
+            self._update_file(nc=nc, row=row, dims=dims)
 
     def _to_xarray(self, mda):
-        """Convert pandas DataFrame to xarray Dataset."""
-        mda = xr.Dataset(mda)
-        mda = mda.rename({"dim_0": "row"})
+        """Convert pandas DataFrame to xarray Dataset.
+
+        Missing values in nullable integer columns are replaced by the fill value, so that
+        these columns can be converted to plain integer arrays at once.
+        """
+        mda = mda.copy()
+        for add_mda in ADDITIONAL_METADATA:
+            if add_mda["name"] in mda and pd.api.types.is_extension_array_dtype(
+                mda[add_mda["name"]]
+            ):
+                mda[add_mda["name"]] = mda[add_mda["name"]].to_numpy(
+                    dtype=add_mda["dtype"], na_value=add_mda["fill_value"]
+                )
+        mda = xr.Dataset(
+            {col: ("row", np.asarray(mda[col].to_numpy())) for col in mda.columns}
+        )
         return mda
 
     def _stack(self, mda):
@@ -457,6 +711,35 @@ class MetadataUpdater:
         )
         return mda
 
+    def _encode_times(self, mda):
+        """Encode timestamps of all files at once.
+
+        Since netCDF4 cannot handle NaT, set missing timestamps to fill value.
+        """
+        for add_mda in ADDITIONAL_METADATA:
+            times = mda[add_mda["name"]]
+            if not np.issubdtype(times.dtype, np.datetime64):
+                continue
+            valid = ~np.isnat(times.values)
+            encoded = np.full(
+                times.shape, add_mda["fill_value"], dtype=add_mda["dtype"]
+            )
+            if valid.any():
+                encoded[valid], _, _ = encode_cf_datetime(
+                    times.values[valid],
+                    units=add_mda["units"],
+                    calendar=add_mda["calendar"],
+                )
+            mda[add_mda["name"]] = (times.dims, encoded)
+        return mda
+
+    def _fill_missing(self, mda):
+        """Set missing values to fill value, since netCDF4 cannot handle NaN."""
+        for var_name, _, fill_value, _ in _ADDITIONAL_METADATA_COMPILED:
+            if fill_value is not None:
+                mda[var_name] = mda[var_name].fillna(fill_value)
+        return mda
+
     def _create_nc_var(self, nc, var_name, fill_value, dtype, shape, dims):
         """Create netCDF variable and dimension."""
         # Create dimension if needed (only 1D at the moment)
@@ -474,36 +757,25 @@ class MetadataUpdater:
             )
         return nc_var
 
-    def _update_file(self, nc, row):
+    def _update_file(self, nc, row, dims):
         """Update metadata of a single file."""
-        for add_mda in ADDITIONAL_METADATA:
-            add_mda = add_mda.copy()
-            var_name = add_mda.pop("name")
-            fill_value = add_mda.pop("fill_value")
-            data = row[var_name]
+        for var_name, dtype, fill_value, attrs in _ADDITIONAL_METADATA_COMPILED:
+            data = np.asarray(row[var_name])
 
             # Create nc variable
             nc_var = self._create_nc_var(
                 nc=nc,
                 var_name=var_name,
                 fill_value=fill_value,
-                dtype=add_mda.pop("dtype"),
-                dims=data.dims,
+                dtype=dtype,
+                dims=dims[var_name],
                 shape=data.shape,
             )
 
-            # Write data to nc variable. Since netCDF4 cannot handle NaN nor NaT, disable
-            # auto-masking, and set null-data to fill value manually.
+            # Write data to nc variable. Missing data have already been set to fill value, so
+            # disable auto-masking.
             nc_var.set_auto_mask(False)
-            if np.issubdtype(data.dtype, np.datetime64):
-                data, _, _ = encode_cf_datetime(
-                    data, units=add_mda["units"], calendar=add_mda["calendar"]
-                )
-                data = np.nan_to_num(data, nan=fill_value)
-            else:
-                data = data.fillna(fill_value).values
             nc_var[:] = data
 
             # Set attributes of nc variable
-            for key, val in add_mda.items():
-                nc_var.setncattr(key, val)
+            nc_var.setncatts(attrs)
@@ -16,17 +16,27 @@
 # You should have received a copy of the GNU General Public License along with
 # pygac-fdr. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import tempfile
 import unittest
 from unittest import mock
 
+import netCDF4
 import numpy as np
 import pandas as pd
 import xarray as xr
 
-from pygac_fdr.metadata import MetadataCollector, QualityFlags
+from pygac_fdr.metadata import (
+    FILL_VALUE_FLOAT,
+    FILL_VALUE_INT,
+    METADATA_DTYPES,
+    MetadataCollector,
+    MetadataUpdater,
+    QualityFlags,
+)
 
 
-def open_dataset_patched(filename):
+def get_acq_time(filename):
     times = {
         "file3": [
             np.datetime64("2009-07-01 00:00"),
@@ -57,10 +67,28 @@ def open_dataset_patched(filename):
             np.datetime64("2009-07-01 04:00"),
         ],
     }
-    times = dict(
-        [(fname, xr.Dataset({"acq_time": time})) for fname, time in times.items()]
-    )
-    return times.get(filename, xr.Dataset({"acq_time": [0]}))
+    return np.array(times.get(filename, [0]), dtype="datetime64[ns]")
+
+
+def get_file_metadata(filename):
+    return {
+        "platform": "NOAA-16",
+        "start_time": np.datetime64("2009-07-01 00:00"),
+        "end_time": np.datetime64("2009-07-01 01:00"),
+        "along_track": 5,
+        "filename": filename,
+        "acq_time": get_acq_time("file3"),
+        "orbit_number_start": 1,
+        "orbit_number_end": 2,
+        "equator_crossing_longitude_1": 1.0,
+        "equator_crossing_time_1": np.datetime64("2009-07-01 00:30"),
+        "equator_crossing_longitude_2": np.nan,
+        "equator_crossing_time_2": np.datetime64("NaT"),
+        "midnight_line": pd.NA,
+        "overlap_free_start": pd.NA,
+        "overlap_free_end": pd.NA,
+        "global_quality_flag": QualityFlags.OK,
+    }
 
 
 class MetadataCollectorTest(unittest.TestCase):
@@ -236,6 +264,9 @@ class MetadataCollectorTest(unittest.TestCase):
             },
         ]
 
+        for rec in mda:
+            rec["acq_time"] = get_acq_time(rec["filename"])
+
         # Add exact copy with another platform
         if multi_platform:
             noaa17 = [rec.copy() for rec in mda]
@@ -243,10 +274,26 @@ class MetadataCollectorTest(unittest.TestCase):
                 rec["platform"] = "NOAA-17"
             mda = mda + noaa17
 
-        return pd.DataFrame(mda)
+        return pd.DataFrame(mda).astype(
+            {
+                "overlap_free_start": "Int16",
+                "overlap_free_start_exp": "Int16",
+                "overlap_free_end": "Int16",
+                "overlap_free_end_exp": "Int16",
+            }
+        )
 
     def test_set_global_qual_flags(self):
         mda = self.get_mda(multi_platform=False)
+
+        # Missing start- or end-time
+        missing = mda[mda["filename"] == "file3"].copy()
+        missing = pd.concat([missing, missing], ignore_index=True)
+        missing.loc[0, "start_time"] = np.datetime64("NaT")
+        missing.loc[1, "end_time"] = np.datetime64("NaT")
+        missing["global_quality_flag_exp"] = QualityFlags.INVALID_TIMESTAMP
+        mda = pd.concat([mda, missing], ignore_index=True)
+
         collector = MetadataCollector()
         mda_qc = collector._set_global_qual_flags(mda, platform="NOAA-16")
         pd.testing.assert_series_equal(
@@ -255,10 +302,29 @@ class MetadataCollectorTest(unittest.TestCase):
             check_names=False,
         )
 
-    @mock.patch("pygac_fdr.metadata.xr.open_dataset")
-    def test_calc_overlap(self, open_dataset):
-        open_dataset.side_effect = open_dataset_patched
+    def test_is_redundant(self):
+        # One long file followed by 20 short files inside of it. Only the current file and
+        # its 19 predecessors are taken into account, so the last short file is not redundant.
+        start_times = [np.datetime64("2009-07-01 00:00")] + [
+            np.datetime64("2009-07-01 00:00") + np.timedelta64(i, "m")
+            for i in range(1, 21)
+        ]
+        end_times = [np.datetime64("2009-07-01 01:40")] + [
+            start_time + np.timedelta64(6, "m") for start_time in start_times[1:]
+        ]
+        start_times = np.array(start_times, dtype="datetime64[ns]").view(np.int64)
+        end_times = np.array(end_times, dtype="datetime64[ns]").view(np.int64)
+        collector = MetadataCollector()
+        ok = np.ones(len(start_times), dtype=bool)
+        redundant = collector._is_redundant(start_times, end_times, ok=ok)
+        np.testing.assert_equal(redundant, [False] + [True] * 19 + [False])
+
+        # Files which did not pass the QC check so far are not taken into account
+        ok[0] = False
+        redundant = collector._is_redundant(start_times, end_times, ok=ok)
+        np.testing.assert_equal(redundant, np.zeros(len(start_times), dtype=bool))
 
+    def test_calc_overlap(self):
         # Get test data and set quality flags as they affect the overlap computation
         mda = self.get_mda(multi_platform=False)
         mda.loc[:, "global_quality_flag"] = mda["global_quality_flag_exp"]
@@ -279,20 +345,17 @@ class MetadataCollectorTest(unittest.TestCase):
 
         # Open end
         mda_overlap_open_end = collector._calc_overlap(mda.copy(), open_end=True)
-        np.testing.assert_equal(
-            mda_overlap_open_end.iloc[-1]["overlap_free_end"], np.nan
-        )
+        self.assertIs(mda_overlap_open_end.iloc[-1]["overlap_free_end"], pd.NA)
 
-    @mock.patch("pygac_fdr.metadata.xr.open_dataset")
     @mock.patch("pygac_fdr.metadata.MetadataCollector._collect_metadata")
-    def test_get_metadata(self, _collect_metadata, open_dataset):
+    def test_get_metadata(self, _collect_metadata):
         _collect_metadata.return_value = self.get_mda(multi_platform=True).sort_values(
             by=["start_time", "end_time"], ascending=False
         )
-        open_dataset.side_effect = open_dataset_patched
 
         collector = MetadataCollector()
         mda = collector.get_metadata("my_filenames")
+        self.assertNotIn("acq_time", mda.columns)
 
         pd.testing.assert_series_equal(
             mda["global_quality_flag"],
@@ -306,8 +369,94 @@ class MetadataCollectorTest(unittest.TestCase):
             mda["overlap_free_end"], mda["overlap_free_end_exp"], check_names=False
         )
 
+    def test_get_metadata_empty(self):
+        collector = MetadataCollector()
+        mda = collector.get_metadata([])
+        self.assertTrue(mda.empty)
+        self.assertEqual(mda.dtypes.to_dict(), METADATA_DTYPES)
+
+        # Same result with cache. Nothing to be cached.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_file = os.path.join(tmpdir, "cache.parquet")
+            mda_cached = collector.get_metadata([], cache_file=cache_file)
+            self.assertFalse(os.path.exists(cache_file))
+        pd.testing.assert_frame_equal(mda_cached, mda)
+
+    @mock.patch("pygac_fdr.metadata.MetadataCollector._collect_file_metadata")
+    def test_collect_metadata(self, _collect_file_metadata):
+        _collect_file_metadata.side_effect = get_file_metadata
+        filenames = ["file{}".format(i) for i in range(10)]
+        collector = MetadataCollector()
+        mda = collector._collect_metadata(filenames)
+        self.assertEqual(mda["filename"].tolist(), filenames)
+        self.assertEqual(mda["platform"].dtype, "category")
+        self.assertEqual(mda["midnight_line"].dtype, "Int16")
+
+    @mock.patch("pygac_fdr.metadata.MetadataCollector._collect_file_metadata")
+    def test_collect_metadata_cached(self, _collect_file_metadata):
+        _collect_file_metadata.side_effect = get_file_metadata
+        collector = MetadataCollector()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = [os.path.join(tmpdir, "file{}".format(i)) for i in range(3)]
+            for filename in filenames:
+                with open(filename, "w") as fh:
+                    fh.write("data")
+            cache_file = os.path.join(tmpdir, "cache.parquet")
+
+            # Empty cache
+            mda = collector._collect_metadata(filenames[0:2], cache_file=cache_file)
+            self.assertEqual(_collect_file_metadata.call_count, 2)
+            self.assertEqual(mda["filename"].tolist(), filenames[0:2])
+
+            # Read modified and new files only, use cache for the rest
+            _collect_file_metadata.reset_mock()
+            with open(filenames[1], "w") as fh:
+                fh.write("modified data")
+            mda = collector._collect_metadata(filenames, cache_file=cache_file)
+            self.assertEqual(
+                [call[0][0] for call in _collect_file_metadata.call_args_list],
+                filenames[1:],
+            )
+            self.assertEqual(sorted(mda["filename"]), filenames)
+            self.assertNotIn("file_size", mda.columns)
+            for acq_time in mda["acq_time"]:
+                np.testing.assert_equal(acq_time, get_acq_time("file3"))
+
+    @mock.patch("pygac_fdr.metadata.MetadataCollector._collect_file_metadata")
+    def test_collect_metadata_cached_repeated_file(self, _collect_file_metadata):
+        _collect_file_metadata.side_effect = get_file_metadata
+        collector = MetadataCollector()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = [os.path.join(tmpdir, "file{}".format(i)) for i in range(2)]
+            for filename in filenames:
+                with open(filename, "w") as fh:
+                    fh.write("data")
+            filenames = [filenames[0], filenames[0], filenames[1]]
+            cache_file = os.path.join(tmpdir, "cache.parquet")
+
+            # Each file is read and cached only once, but returned as often as requested
+            for _ in range(2):
+                mda = collector._collect_metadata(filenames, cache_file=cache_file)
+                self.assertEqual(mda["filename"].tolist(), filenames)
+                self.assertEqual(len(pd.read_parquet(cache_file)), 2)
+            self.assertEqual(_collect_file_metadata.call_count, 2)
+
+    def test_save_read_sql(self):
+        mda = pd.DataFrame(
+            [get_file_metadata("file1"), get_file_metadata("file2")]
+        ).drop(["acq_time"], axis=1)
+        mda = mda.astype(METADATA_DTYPES)
+        mda.loc[0, "midnight_line"] = 123
+        collector = MetadataCollector()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dbfile = os.path.join(tmpdir, "test.sqlite3")
+            collector.save_sql(mda, dbfile, if_exists="fail")
+            collector.save_sql(mda, dbfile, if_exists="replace")
+            mda_read = collector.read_sql(dbfile)
+        pd.testing.assert_frame_equal(mda_read, mda)
+
     def test_get_midnight_line(self):
-        acq_time = xr.DataArray(
+        acq_time = np.array(
             [
                 np.datetime64("2009-12-31 23:58:00"),
                 np.datetime64("2009-12-31 23:59:00"),
@@ -320,14 +469,14 @@ class MetadataCollectorTest(unittest.TestCase):
         self.assertEqual(midn_line, 1)
 
         # No date switch
-        acq_time = xr.DataArray(
+        acq_time = np.array(
             [
                 np.datetime64("2010-01-01 00:00:01"),
                 np.datetime64("2010-01-01 00:01:00"),
                 np.datetime64("2010-01-01 00:02:00"),
             ]
         )
-        np.testing.assert_equal(collector._get_midnight_line(acq_time), np.nan)
+        self.assertIs(collector._get_midnight_line(acq_time), pd.NA)
 
     def test_get_equator_crossings(self):
         collector = MetadataCollector()
@@ -346,7 +495,7 @@ class MetadataCollectorTest(unittest.TestCase):
                 "acq_time": ("y", np.arange(3).astype("datetime64[s]")),
             }
         )
-        lons, times = collector._get_equator_crossings(ds)
+        lons, times = collector._get_equator_crossings(ds, ds["acq_time"].values)
         np.testing.assert_equal(lons, [np.nan, np.nan])
         self.assertTrue(np.all(np.isnat(times)))
 
@@ -377,7 +526,7 @@ class MetadataCollectorTest(unittest.TestCase):
             }
         )
         ds["acq_time"].attrs["coords"] = "latitude longitude"
-        lons, times = collector._get_equator_crossings(ds)
+        lons, times = collector._get_equator_crossings(ds, ds["acq_time"].values)
         np.testing.assert_equal(lons, [3, np.nan])
         np.testing.assert_equal(
             times, [np.datetime64("1970-01-01 00:00:02"), np.datetime64("NaT")]
@@ -413,7 +562,7 @@ class MetadataCollectorTest(unittest.TestCase):
         )
         ds["acq_time"].attrs["coords"] = "latitude longitude"
         collector = MetadataCollector()
-        lons, times = collector._get_equator_crossings(ds)
+        lons, times = collector._get_equator_crossings(ds, ds["acq_time"].values)
         np.testing.assert_equal(lons, [1, 3])
         np.testing.assert_equal(
             times,
@@ -422,3 +571,106 @@ class MetadataCollectorTest(unittest.TestCase):
                 np.datetime64("1970-01-01 00:00:02"),
             ],
         )
+
+
+class MetadataUpdaterTest(unittest.TestCase):
+    def get_mda(self, filenames):
+        mda = pd.DataFrame(
+            [get_file_metadata(filename) for filename in filenames]
+        ).drop(["acq_time"], axis=1)
+        mda = mda.astype(METADATA_DTYPES)
+
+        # First file: All metadata available
+        mda.loc[0, "equator_crossing_longitude_2"] = 2.0
+        mda.loc[0, "equator_crossing_time_2"] = np.datetime64("2009-07-01 00:45")
+        mda.loc[0, "midnight_line"] = 3
+        mda.loc[0, "overlap_free_start"] = 1
+        mda.loc[0, "overlap_free_end"] = 4
+
+        # Second file: No equator crossing, no overlap information
+        mda.loc[1, "equator_crossing_longitude_1"] = np.nan
+        mda.loc[1, "equator_crossing_time_1"] = np.datetime64("NaT")
+        mda.loc[1, "global_quality_flag"] = QualityFlags.REDUNDANT
+        return mda
+
+    def test_update(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = [os.path.join(tmpdir, "file{}.nc".format(i)) for i in range(2)]
+            for filename in filenames:
+                with netCDF4.Dataset(filename, mode="w") as nc:
+                    nc.createDimension("y", 5)
+                    nc.createVariable("acq_time", np.float64, dimensions=("y",))
+            mda = self.get_mda(filenames)
+
+            # Update twice to make sure existing variables are overwritten
+            updater = MetadataUpdater(num_workers=2)
+            updater.update(mda)
+            with self.assertLogs("pygac_fdr", level="DEBUG") as logs:
+                updater.update(mda)
+            for filename in filenames:
+                self.assertIn(
+                    "DEBUG:pygac_fdr:Updated metadata in {}".format(filename),
+                    logs.output,
+                )
+
+            with netCDF4.Dataset(filenames[0]) as nc:
+                nc.set_auto_mask(False)
+                np.testing.assert_equal(nc["equator_crossing_longitude"][:], [1.0, 2.0])
+                np.testing.assert_equal(
+                    nc["equator_crossing_time"][:], [1246408200.0, 1246409100.0]
+                )
+                self.assertEqual(nc["midnight_line"][:], 3)
+                self.assertEqual(nc["overlap_free_start"][:], 1)
+                self.assertEqual(nc["overlap_free_end"][:], 4)
+                self.assertEqual(nc["global_quality_flag"][:], QualityFlags.OK)
+
+                # Data types and attributes
+                self.assertEqual(nc.dimensions["num_eq_cross"].size, 2)
+                self.assertEqual(nc["equator_crossing_time"].dtype, np.float64)
+                self.assertEqual(
+                    nc["equator_crossing_time"].units,
+                    "seconds since 1970-01-01 00:00:00",
+                )
+                self.assertEqual(nc["equator_crossing_time"].calendar, "standard")
+                self.assertEqual(nc["equator_crossing_longitude"].units, "degrees_east")
+                self.assertEqual(nc["midnight_line"].dtype, np.int16)
+                self.assertEqual(nc["midnight_line"]._FillValue, FILL_VALUE_INT)
+                self.assertEqual(nc["global_quality_flag"].dtype, np.uint8)
+                self.assertNotIn("_FillValue", nc["global_quality_flag"].ncattrs())
+                np.testing.assert_equal(
+                    nc["global_quality_flag"].flag_values, [0, 1, 2, 3, 4, 5]
+                )
+                self.assertEqual(
+                    nc["global_quality_flag"].flag_meanings,
+                    "ok invalid_timestamp too_short too_long duplicate redundant",
+                )
+
+            with netCDF4.Dataset(filenames[1]) as nc:
+                nc.set_auto_mask(False)
+                np.testing.assert_equal(
+                    nc["equator_crossing_longitude"][:],
+                    [FILL_VALUE_FLOAT, FILL_VALUE_FLOAT],
+                )
+                np.testing.assert_equal(
+                    nc["equator_crossing_time"][:], [FILL_VALUE_FLOAT, FILL_VALUE_FLOAT]
+                )
+                self.assertEqual(nc["midnight_line"][:], FILL_VALUE_INT)
+                self.assertEqual(nc["overlap_free_start"][:], FILL_VALUE_INT)
+                self.assertEqual(nc["overlap_free_end"][:], FILL_VALUE_INT)
+                self.assertEqual(nc["global_quality_flag"][:], QualityFlags.REDUNDANT)
+
+    def test_update_failure(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = [os.path.join(tmpdir, "file{}.nc".format(i)) for i in range(2)]
+            for filename in filenames:
+                with open(filename, "w") as fh:
+                    fh.write("not a netCDF file")
+            mda = self.get_mda(filenames)
+            updater = MetadataUpdater(num_workers=1)
+            with self.assertLogs("pygac_fdr", level="ERROR") as logs:
+                with self.assertRaises(OSError):
+                    updater.update(mda)
+            self.assertIn(
+                "ERROR:pygac_fdr:Failed to update metadata in {}".format(filenames[0]),
+                logs.output,
+            )
@@ -33,7 +33,7 @@ except ImportError:
 if __name__ == "__main__":
     requires = [
         "setuptools_scm",
-        "numpy",
+        "numpy >=1.20",
         "xarray >=0.15.1",
         "pandas >=1.0.3",
         "netCDF4",
@@ -50,7 +50,10 @@ if __name__ == "__main__":
             "pytest-cov",
             "pytest-testconfig",
             "matplotlib",
+            "pyarrow",
         ],
+        "cache": ["pyarrow"],
+        "numba": ["numba"],
         "dev": ["pre-commit"],
     }
     README = open("README.md", "r").read()